@@ -1,8 +1,11 @@
-import json
-from datetime import datetime
+import asyncio
+from datetime import datetime, timezone
+from hashlib import blake2b
 from sys import exit, stderr
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
 
+import orjson
+from httpx import AsyncClient, Timeout
 from loguru import logger
 from notifiers.logging import NotificationHandler
 
@@ -16,7 +19,7 @@ class Broadcast:
     https://github.com/EthanC/Broadcast
     """
 
-    def Initialize(self: Any) -> None:
+    async def Initialize(self: Any) -> None:
         """Initialize Broadcast and begin primary functionality."""
 
         logger.info("Broadcast")
@@ -31,11 +34,57 @@ class Broadcast:
 
         sources: Dict[str, Dict[str, Any]] = self.config["sources"]
 
-        if sources["blog"]["enable"] is True:
-            Broadcast.ProcessBlog(self, sources["blog"]["language"])
+        # Share a single client so that both feeds and any resulting
+        # notifications reuse the same connection pool. Connecting should be
+        # quick, so fail fast there and allow more time to read the feed.
+        async with AsyncClient(
+            http2=True, timeout=Timeout(connect=3.0, read=10.0, write=5.0, pool=5.0)
+        ) as client:
+            self.client: AsyncClient = client
+
+            # Persist circuit breakers alongside the feed history so that an
+            # unavailable host is skipped across consecutive runs.
+            self.breakers: Dict[str, Dict[str, Any]] = self.history["breakers"]
+
+            # Sources of the same language are served by the same feed, so
+            # request each language only once and share the parsed result.
+            languages: Dict[str, List[str]] = {}
+
+            for name, source in sources.items():
+                if source["enable"] is True:
+                    languages.setdefault(source["language"], []).append(name)
+
+            urls: List[str] = [
+                f"https://www.callofduty.com/site/cod/franchiseFeed/{language}"
+                for language in languages
+            ]
+
+            # Request feeds conditionally on the last response which was fully
+            # processed, so that unchanged feeds are not downloaded again.
+            # Feeds with an untracked source are always requested in full.
+            validators: List[Dict[str, str]] = [
+                {}
+                if any(len(self.history[name]) == 0 for name in names)
+                else dict(self.history["feeds"].get(url, {}))
+                for url, names in zip(urls, languages.values())
+            ]
+
+            feeds: List[
+                Tuple[Optional[Dict[str, Any]], Optional[Dict[str, str]], bool]
+            ] = await Utility.GETMany(self, urls, validators)
+            results: List[bool] = await asyncio.gather(
+                *[
+                    Broadcast.ProcessFeed(self, names, data, modified)
+                    for names, (data, _, modified) in zip(languages.values(), feeds)
+                ]
+            )
 
-        if sources["motd"]["enable"] is True:
-            Broadcast.ProcessMOTD(self, sources["motd"]["language"])
+        for url, (_, validator, _), result in zip(urls, feeds, results):
+            # Ensure no feed is skipped before it has been fully processed
+            if (result is True) and (validator is not None):
+                if validator != self.history["feeds"].get(url, {}):
+                    self.history["feeds"][url] = validator
+                    self.changed = True
 
         if self.changed is True:
             Broadcast.SaveHistory(self)
@@ -46,8 +95,8 @@ class Broadcast:
         """Load the configuration values specified in config.json"""
 
         try:
-            with open("config.json", "r") as file:
-                config: Dict[str, Any] = json.loads(file.read())
+            with open("config.json", "rb") as file:
+                config: Dict[str, Any] = orjson.loads(file.read())
         except Exception as e:
             logger.critical(f"Failed to load configuration, {e}")
 
@@ -100,11 +149,22 @@ class Broadcast:
     def LoadHistory(self: Any) -> Dict[str, Any]:
         """Load the last seen feed items specified in history.json"""
 
+        # Digest of history.json as loaded, used to skip no-op saves
+        self.historyHash: Optional[bytes] = None
+
         try:
-            with open("history.json", "r") as file:
-                history: Dict[str, Any] = json.loads(file.read())
+            with open("history.json", "rb") as file:
+                content: bytes = file.read()
+
+            history: Dict[str, Any] = orjson.loads(content)
+            self.historyHash = blake2b(content).digest()
         except FileNotFoundError:
-            history: Dict[str, Any] = {"blog": [], "motd": []}
+            history: Dict[str, Any] = {
+                "blog": [],
+                "motd": [],
+                "feeds": {},
+                "breakers": {},
+            }
             self.changed = True
 
             logger.success("Feed history not found, created empty file")
@@ -119,41 +179,67 @@ class Broadcast:
         if history.get("motd") is None:
             history["motd"] = []
 
+        if history.get("feeds") is None:
+            history["feeds"] = {}
+
+        if history.get("breakers") is None:
+            history["breakers"] = {}
+
         logger.success("Loaded feed history")
 
         return history
 
-    def ProcessBlog(self: Any, language: str) -> None:
+    async def ProcessFeed(
+        self: Any, names: List[str], data: Optional[Dict[str, Any]], modified: bool
+    ) -> bool:
         """
-        Get the current Call of Duty blog feed and determine whether or not
-        it has updated.
+        Process the provided Call of Duty franchise feed for each of the
+        specified sources and return whether or not all of them completed.
         """
 
-        past: List[str] = self.history["blog"]
-        blogChanged: bool = False
+        # The feed was not modified since it was last fully processed
+        if modified is False:
+            logger.info(f"Call of Duty feed not updated ({', '.join(names)})")
+
+            return True
+
+        processors: Dict[str, Callable[..., Awaitable[bool]]] = {
+            "blog": Broadcast.ProcessBlog,
+            "motd": Broadcast.ProcessMOTD,
+        }
 
-        data: Optional[Dict[str, Any]] = Utility.GET(
-            self, f"https://www.callofduty.com/site/cod/franchiseFeed/{language}"
+        results: List[bool] = await asyncio.gather(
+            *[processors[name](self, data) for name in names]
         )
-        length: int = len(data.get("blog", []))
 
-        try:
-            if (data is None) or (length == 0):
-                raise ValueError("did not receive a valid response")
-            elif length != 104:
-                raise ValueError(
-                    f"received invalid response (expected length 104 got {length:,})"
-                )
-        except Exception as e:
-            logger.debug(f"Failed to process Call of Duty blog, {e}")
+        return all(results)
 
-            return
+    async def ProcessBlog(self: Any, data: Optional[Dict[str, Any]]) -> bool:
+        """
+        Determine whether or not the provided Call of Duty blog feed has
+        updated and return whether or not it was fully processed.
+        """
 
-        current: List[str] = []
-        data = data["blog"][:5]
+        past: Set[str] = set(self.history["blog"])
+        blogChanged: bool = False
 
-        for item in data:
-            current.append(item.get("url", "Unknown").replace("?app=true", ""))
+        if (data is None) or (len(blog := data.get("blog", [])) == 0):
+            logger.debug(
+                "Failed to process Call of Duty blog, did not receive a valid response"
+            )
+
+            return False
+        elif (length := len(blog)) != 104:
+            logger.debug(
+                f"Failed to process Call of Duty blog, received invalid response (expected length 104 got {length:,})"
+            )
+
+            return False
+
+        data = blog[:5]
+        current: List[str] = [
+            item.get("url", "Unknown").removesuffix("?app=true") for item in data
+        ]
 
         if len(past) == 0:
             logger.info(
@@ -164,11 +250,12 @@ class Broadcast:
             self.changed = True
             blogChanged = True
 
-            return
+            return True
 
-        for item in data:
-            url: str = item.get("url", "Unknown").replace("?app=true", "")
+        pending: List[Dict[str, Any]] = []
+        keys: List[str] = []
 
+        for url, item in zip(current, data):
             if url in past:
                 continue
 
@@ -180,7 +267,7 @@ class Broadcast:
                 fields.append(
                     {
                         "name": "Content Type",
-                        "value": Utility.Unslug(self, value),
+                        "value": Utility.Unslug(value),
                         "inline": True,
                     }
                 )
@@ -189,7 +276,7 @@ class Broadcast:
                 fields.append(
                     {
                         "name": "Game",
-                        "value": Utility.Unslug(self, value),
+                        "value": Utility.Unslug(value),
                         "inline": True,
                     }
                 )
@@ -206,49 +293,49 @@ class Broadcast:
                         }
                     )
 
-            success: bool = Broadcast.Notify(
-                self,
+            pending.append(
                 {
                     "title": item["title"],
                     "description": item.get("subTitle"),
                     "url": url,
-                    "color": int("FFFFFF", base=16),
+                    "color": 0xFFFFFF,
                     "image": item["dimg"],
                     "author": item.get("author"),
                     "fields": fields,
-                },
+                }
             )
+            keys.append(url)
+
+        # Ensure no changes go without notification, saving only those which
+        # were delivered so that the remainder are retried next run.
+        delivered: int = await Broadcast.Notify(self, pending)
 
-            # Ensure no changes go without notification
-            if success is True:
-                self.history["blog"] = current
-                self.changed = True
-                blogChanged = True
+        if delivered > 0:
+            sent: Set[str] = set(keys[:delivered])
+
+            self.history["blog"] = [i for i in current if (i in past) or (i in sent)]
+            self.changed = True
+            blogChanged = True
 
         if blogChanged is not True:
             logger.info("Call of Duty blog not updated")
 
-    def ProcessMOTD(self: Any, language: str) -> None:
+        return delivered == len(pending)
+
+    async def ProcessMOTD(self: Any, data: Optional[Dict[str, Any]]) -> bool:
         """
-        Get the current Call of Duty Message of the Day feed and determine whether
-        or not it has updated.
+        Determine whether or not the provided Call of Duty Message of the Day
+        feed has updated and return whether or not it was fully processed.
         """
 
-        past: List[str] = self.history["motd"]
+        past: Set[str] = set(self.history["motd"])
         motdChanged: bool = False
 
-        data: Optional[Dict[str, Any]] = Utility.GET(
-            self, f"https://www.callofduty.com/site/cod/franchiseFeed/{language}"
-        )
-
         if (data is None) or (len(data.get("mobileMotd", [])) == 0):
-            return
+            return False
 
-        current: List[str] = []
         data = data["mobileMotd"]
-
-        for item in data:
-            current.append(item["name"])
+        current: List[str] = [item["name"] for item in data]
 
         if len(past) == 0:
             logger.info(
@@ -259,7 +346,10 @@ class Broadcast:
             self.changed = True
             motdChanged = True
 
-            return
+            return True
+
+        pending: List[Dict[str, Any]] = []
+        keys: List[str] = []
 
         for item in data:
             name: str = item["name"]
@@ -280,46 +370,56 @@ class Broadcast:
                     }
                 )
 
-            self.history["motd"] = current
-            self.changed = True
-            motdChanged = True
-
-            success: bool = Broadcast.Notify(
-                self,
+            pending.append(
                 {
                     "title": item["data"]["title"],
-                    "description": Utility.ConvertHTML(self, item["data"]["entryText"]),
-                    "color": int("FFFFFF", base=16),
+                    "description": Utility.ConvertHTML(item["data"]["entryText"]),
+                    "color": 0xFFFFFF,
                     "image": None
                     if (i := item["data"].get("image")) is None
                     else f"https://callofduty.com{i}",
                     "fields": fields,
-                },
+                }
             )
+            keys.append(name)
+
+        # Ensure no changes go without notification, saving only those which
+        # were delivered so that the remainder are retried next run.
+        delivered: int = await Broadcast.Notify(self, pending)
 
-            # Ensure no changes go without notification
-            if success is True:
-                self.history["motd"] = current
-                self.changed = True
-                motdChanged = True
+        if delivered > 0:
+            sent: Set[str] = set(keys[:delivered])
+
+            self.history["motd"] = [i for i in current if (i in past) or (i in sent)]
+            self.changed = True
+            motdChanged = True
 
         if motdChanged is not True:
             logger.info("Call of Duty Message of the Day not updated")
 
-    def Notify(self: Any, data: Dict[str, Any]) -> bool:
-        """Report feed updates to the configured Discord webhook."""
+        return delivered == len(pending)
 
-        settings: Dict[str, Any] = self.config["discord"]
+    async def Notify(self: Any, items: List[Dict[str, Any]]) -> int:
+        """
+        Report feed updates to the configured Discord webhook and return the
+        number of them, in order, which were delivered. Updates are batched
+        into as few messages as Discord allows.
+        """
 
-        payload: Dict[str, Any] = {
-            "username": settings["username"],
-            "avatar_url": settings["avatarUrl"],
-            "embeds": [
+        settings: Dict[str, Any] = self.config["discord"]
+        now: str = datetime.now(timezone.utc).isoformat()
+        embeds: List[Dict[str, Any]] = []
+        batches: List[List[Dict[str, Any]]] = []
+        batchLength: int = 0
+        delivered: int = 0
+
+        for data in items:
+            embeds.append(
                 {
                     "title": data["title"],
                     "description": data["description"],
                     "url": data.get("url"),
-                    "timestamp": datetime.utcnow().isoformat()
+                    "timestamp": now
                     if (timestamp := data.get("timestamp")) is None
                     else timestamp,
                     "color": data["color"],
@@ -331,10 +431,37 @@ class Broadcast:
                     "author": {"name": data.get("author")},
                     "fields": data["fields"],
                 }
-            ],
-        }
+            )
+
+        # Discord accepts a maximum of 10 embeds, totalling 6,000 characters,
+        # per message.
+        for embed in embeds:
+            length: int = Utility.EmbedLength(embed)
+
+            if (len(batches) == 0) or (
+                (len(batches[-1]) >= 10) or (batchLength + length > 6000)
+            ):
+                batches.append([])
+                batchLength = 0
+
+            batches[-1].append(embed)
+            batchLength += length
 
-        return Utility.POST(self, settings["webhookUrl"], payload)
+        for batch in batches:
+            payload: Dict[str, Any] = {
+                "username": settings["username"],
+                "avatar_url": settings["avatarUrl"],
+                "embeds": batch,
+            }
+
+            # Stop at the first failure so that delivered updates remain in
+            # order and the rest are retried next run.
+            if await Utility.POST(self, settings["webhookUrl"], payload) is not True:
+                break
+
+            delivered += len(batch)
+
+        return delivered
 
     def SaveHistory(self: Any) -> None:
         """Save the latest feed items to history.json"""
@@ -344,9 +471,16 @@ class Broadcast:
 
             return
 
+        content: bytes = orjson.dumps(self.history)
+
+        if blake2b(content).digest() == self.historyHash:
+            logger.info("Feed history unchanged, not saving")
+
+            return
+
         try:
-            with open("history.json", "w+") as file:
-                file.write(json.dumps(self.history, indent=4))
+            with open("history.json", "wb") as file:
+                file.write(content)
         except Exception as e:
             logger.critical(f"Failed to save feed history, {e}")
 
@@ -357,6 +491,6 @@ class Broadcast:
 
 if __name__ == "__main__":
     try:
-        Broadcast.Initialize(Broadcast)
+        asyncio.run(Broadcast.Initialize(Broadcast))
     except KeyboardInterrupt:
         exit()
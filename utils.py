@@ -1,129 +1,314 @@
-import json
-from time import sleep
-from typing import Any, Dict, List, Optional
-
-import httpx
-from httpx import HTTPError, Response, TimeoutException
+import asyncio
+import random
+from functools import lru_cache
+from time import time
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+from urllib.parse import urlsplit
+
+import orjson
+from httpx import HTTPError, HTTPStatusError, Response, TimeoutException
 from loguru import logger
-from markdownify import markdownify
+from markdownify import MarkdownConverter
+
+# ConvertHTML always uses the same options, so build the converter once
+# rather than on every call.
+markdown: MarkdownConverter = MarkdownConverter(heading_style="ATX", bullets="-")
 
 
 class Utility:
     """Utilitarian functions designed for Broadcast."""
 
-    def GET(self: Any, url: str, isRetry: bool = False) -> Optional[Dict[str, Any]]:
-        """Perform an HTTP GET request and return its response."""
+    async def GET(
+        self: Any, url: str, validators: Optional[Dict[str, str]] = None
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, str]], bool]:
+        """
+        Perform an HTTP GET request and return its response, the validators
+        of the response, and whether or not the resource was modified. Failed
+        requests are retried with exponential backoff using the configured
+        values and return no response or validators.
 
-        logger.debug(f"GET {url}")
+        If validators are provided, the request is conditional upon them.
+        """
 
-        try:
-            res: Response = httpx.get(url)
-            status: int = res.status_code
-            data: str = res.text
+        settings: Dict[str, Any] = self.config.get("network", {})
+        retries: int = settings.get("retries", 3)
+        retryDelay: float = settings.get("retryDelay", 1.0)
+        retryDelayMax: float = settings.get("retryDelayMax", 30.0)
 
-            res.raise_for_status()
-        except HTTPError as e:
-            if isRetry is False:
-                logger.debug(f"(HTTP {status}) GET {url} failed, {e}... Retry in 10s")
+        if Utility.CircuitOpen(self, url) is True:
+            logger.debug("GET {} skipped, host is unavailable", url)
 
-                sleep(10)
+            return None, None, True
 
-                return Utility.GET(self, url, True)
+        headers: Dict[str, str] = {}
 
-            logger.error(f"(HTTP {status}) GET {url} failed, {e}")
+        if validators is not None:
+            if (etag := validators.get("etag")) is not None:
+                headers["If-None-Match"] = etag
 
-            return
-        except TimeoutException as e:
-            if isRetry is False:
-                logger.debug(f"GET {url} failed, {e}... Retry in 10s")
+            if (lastModified := validators.get("lastModified")) is not None:
+                headers["If-Modified-Since"] = lastModified
 
-                sleep(10)
+        logger.debug("GET {}", url)
 
-                return Utility.GET(self, url, True)
+        for attempt in range(retries + 1):
+            # Jitter the delay so that retries do not align with other clients
+            delay: float = min(retryDelayMax, retryDelay * (2**attempt)) * (
+                1 + random.uniform(0, 0.5)
+            )
 
-            # TimeoutException is common, no need to log as error
-            logger.debug(f"GET {url} failed, {e}")
+            # Requests may fail before a response, and its status, is received
+            status: Union[int, str] = "n/a"
 
-            return
-        except Exception as e:
-            if isRetry is False:
-                logger.debug(f"GET {url} failed, {e}... Retry in 10s")
+            try:
+                res: Response = await self.client.get(url, headers=headers)
+                status = res.status_code
 
-                sleep(10)
+                if status == 304:
+                    Utility.CircuitRecord(self, url, True)
 
-                return Utility.GET(self, url, True)
+                    logger.debug("GET {} not modified", url)
 
-            logger.error(f"GET {url} failed, {e}")
+                    return None, validators, False
 
-            return
+                res.raise_for_status()
+
+                # Only decode the response body to text when it will be logged
+                logger.opt(lazy=True).trace("{}", lambda: res.text)
+
+                # Invalid bodies are treated as a failed attempt, like any
+                # other error, rather than escaping to the caller.
+                data: Dict[str, Any] = orjson.loads(res.content)
+            except TimeoutException as e:
+                Utility.CircuitRecord(self, url, False)
+
+                if (attempt < retries) and (Utility.CircuitOpen(self, url) is False):
+                    logger.debug("GET {} failed, {}... Retry in {:.1f}s", url, e, delay)
+
+                    await asyncio.sleep(delay)
+
+                    continue
+
+                # TimeoutException is common, no need to log as error
+                logger.debug("GET {} failed, {}", url, e)
+
+                return None, None, True
+            except HTTPError as e:
+                # Client errors other than rate limiting will not resolve
+                # themselves, so fail fast rather than retrying them.
+                if (isinstance(e, HTTPStatusError)) and (
+                    (400 <= status < 500) and (status != 429)
+                ):
+                    logger.error(f"(HTTP {status}) GET {url} failed, {e}")
+
+                    return None, None, True
+
+                Utility.CircuitRecord(self, url, False)
+
+                if (attempt < retries) and (Utility.CircuitOpen(self, url) is False):
+                    logger.debug(
+                        "(HTTP {}) GET {} failed, {}... Retry in {:.1f}s",
+                        status,
+                        url,
+                        e,
+                        delay,
+                    )
+
+                    await asyncio.sleep(delay)
+
+                    continue
+
+                logger.error(f"(HTTP {status}) GET {url} failed, {e}")
+
+                return None, None, True
+            except Exception as e:
+                Utility.CircuitRecord(self, url, False)
+
+                if (attempt < retries) and (Utility.CircuitOpen(self, url) is False):
+                    logger.debug("GET {} failed, {}... Retry in {:.1f}s", url, e, delay)
+
+                    await asyncio.sleep(delay)
+
+                    continue
+
+                logger.error(f"GET {url} failed, {e}")
+
+                return None, None, True
+
+            Utility.CircuitRecord(self, url, True)
+
+            latest: Dict[str, str] = {}
+
+            if (etag := res.headers.get("etag")) is not None:
+                latest["etag"] = etag
 
-        logger.trace(data)
+            if (lastModified := res.headers.get("last-modified")) is not None:
+                latest["lastModified"] = lastModified
 
-        return json.loads(data)
+            return data, latest, True
 
-    def POST(self: Any, url: str, payload: Dict[str, Any]) -> bool:
+    async def GETMany(
+        self: Any,
+        urls: List[str],
+        validators: Optional[List[Optional[Dict[str, str]]]] = None,
+    ) -> List[Tuple[Optional[Dict[str, Any]], Optional[Dict[str, str]], bool]]:
+        """
+        Perform HTTP GET requests for the provided urls concurrently and return
+        their results in the same order. Validators, if provided, are paired
+        with the urls by position.
+        """
+
+        if validators is None:
+            validators = [None] * len(urls)
+
+        return await asyncio.gather(
+            *[Utility.GET(self, url, v) for url, v in zip(urls, validators)]
+        )
+
+    async def POST(self: Any, url: str, payload: Dict[str, Any]) -> bool:
         """Perform an HTTP POST request and return its status."""
 
+        if Utility.CircuitOpen(self, url) is True:
+            logger.debug("POST {} skipped, host is unavailable", url)
+
+            return False
+
+        # Requests may fail before a response, and its status, is received
+        status: Union[int, str] = "n/a"
+
         try:
-            res: Response = httpx.post(
+            res: Response = await self.client.post(
                 url,
-                data=json.dumps(payload),
+                content=orjson.dumps(payload),
                 headers={"content-type": "application/json"},
             )
-            status: int = res.status_code
-            data: str = res.text
+            status = res.status_code
 
             res.raise_for_status()
-        except HTTPError as e:
-            logger.error(f"(HTTP {status}) POST {url} failed, {e}")
-
-            return False
         except TimeoutException as e:
+            Utility.CircuitRecord(self, url, False)
+
             # TimeoutException is common, no need to log as error
-            logger.debug(f"POST {url} failed, {e}")
+            logger.debug("POST {} failed, {}", url, e)
+
+            return False
+        except HTTPError as e:
+            # Client errors other than rate limiting are caused by the
+            # request, not the host
+            if not (
+                (isinstance(e, HTTPStatusError))
+                and ((400 <= status < 500) and (status != 429))
+            ):
+                Utility.CircuitRecord(self, url, False)
+
+            logger.error(f"(HTTP {status}) POST {url} failed, {e}")
 
             return False
         except Exception as e:
+            Utility.CircuitRecord(self, url, False)
+
             logger.error(f"POST {url} failed, {e}")
 
             return False
 
-        logger.trace(data)
+        Utility.CircuitRecord(self, url, True)
+
+        logger.opt(lazy=True).trace("{}", lambda: res.text)
 
         return True
 
-    def ConvertHTML(self: Any, input: str) -> str:
-        """Convert the provided HTML string to markdown format."""
+    def CircuitOpen(self: Any, url: str) -> bool:
+        """
+        Determine whether or not the circuit breaker for the host of the
+        provided url is open, meaning requests to it should not be attempted.
+        """
 
-        return markdownify(input, heading_style="ATX", bullets="-")
+        settings: Dict[str, Any] = self.config.get("network", {})
+        breaker: Optional[Dict[str, Any]] = self.breakers.get(urlsplit(url).netloc)
 
-    def Unslug(self: Any, input: str) -> str:
-        """Convert the provided slug strings to a human-readable format."""
+        if (breaker is None) or (
+            breaker["failures"] < settings.get("breakerThreshold", 5)
+        ):
+            return False
+        elif breaker["openUntil"] > time():
+            return True
 
-        alwaysCaps: List[str] = ["COD", "CDL"]
+        # Once the cooldown has passed, allow a single request through to
+        # probe whether or not the host has recovered and keep the breaker
+        # open for all others until the outcome is recorded.
+        breaker["openUntil"] = time() + settings.get("breakerCooldown", 900.0)
+        self.changed = True
 
-        result: str = ""
+        return False
 
-        items: List[str] = input.split(",")
-        i: int = 0
+    def CircuitRecord(self: Any, url: str, success: bool) -> None:
+        """
+        Record the outcome of a request to the host of the provided url and
+        open its circuit breaker after too many consecutive failures.
+        """
 
-        for item in items:
-            parts: List[str] = item.split("-")
-            p: int = 0
+        settings: Dict[str, Any] = self.config.get("network", {})
+        host: str = urlsplit(url).netloc
 
-            for part in parts:
-                if (v := part.upper()) in alwaysCaps:
-                    result += v
-                else:
-                    result += part.title()
+        if success is True:
+            if self.breakers.pop(host, None) is not None:
+                self.changed = True
 
-                p += 1
+            return
+
+        breaker: Dict[str, Any] = self.breakers.setdefault(
+            host, {"failures": 0, "openUntil": 0.0}
+        )
+        breaker["failures"] += 1
+        self.changed = True
+
+        if breaker["failures"] >= settings.get("breakerThreshold", 5):
+            cooldown: float = settings.get("breakerCooldown", 900.0)
+            breaker["openUntil"] = time() + cooldown
+
+            logger.warning(
+                f"{host} failed {breaker['failures']:,} consecutive requests, pausing requests for {cooldown:,}s"
+            )
 
-                if p < len(parts):
-                    result += " "
-            i += 1
+    @staticmethod
+    def EmbedLength(embed: Dict[str, Any]) -> int:
+        """
+        Return the number of characters of the provided Discord embed which
+        count towards the message limit.
+        """
 
-            if i < len(items):
-                result += ", "
+        values: List[Optional[str]] = [
+            embed.get("title"),
+            embed.get("description"),
+            embed.get("footer", {}).get("text"),
+            embed.get("author", {}).get("name"),
+        ]
 
-        return result
+        for field in embed.get("fields", []):
+            values.extend([field.get("name"), field.get("value")])
+
+        return sum(len(value) for value in values if value is not None)
+
+    @staticmethod
+    def ConvertHTML(input: str) -> str:
+        """Convert the provided HTML string to markdown format."""
+
+        return markdown.convert(input)
+
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def Unslug(input: str) -> str:
+        """
+        Convert the provided slug strings to a human-readable format. Results
+        are cached as the same slugs repeat throughout a feed.
+        """
+
+        alwaysCaps: Set[str] = {"COD", "CDL"}
+
+        return ", ".join(
+            " ".join(
+                v if (v := part.upper()) in alwaysCaps else part.title()
+                for part in item.split("-")
+            )
+            for item in input.split(",")
+        )